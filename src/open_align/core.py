@@ -1,6 +1,9 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Sequence, Tuple
 import typer
 from rich import print as rprint
 import cv2 as cv
@@ -13,41 +16,106 @@ class PairMatches:
     n_ref_kp: int
     n_img_kp: int
     n_good: int
-    good_matches: List[cv.DMatch]
-    ref_pts: np.ndarray  # shape: (N, 1, 2), float32
-    img_pts: np.ndarray  # shape: (N, 1, 2), float32
+    ref_idx: np.ndarray  # shape: (N,), int32, matched reference keypoint indices
+    img_idx: np.ndarray  # shape: (N,), int32, matched image keypoint indices
+    ref_pts: np.ndarray  # shape: (N, 1, 2), float32, full-res ref coords
+    img_pts: np.ndarray  # shape: (N, 1, 2), float32, full-res image coords
 
 def _read_bgr(path: Path) -> np.ndarray | None:
     return cv.imread(str(path), cv.IMREAD_COLOR)
 
-def _to_gray(bgr: np.ndarray) -> np.ndarray:
+# OpenCV's T-API runs cvtColor/resize (and parts of ORB) through OpenCL
+# when handed a UMat; without a device we stay on plain ndarrays
+_USE_OPENCL = cv.ocl.haveOpenCL()
+
+def _to_device(img: np.ndarray):
+    return cv.UMat(img) if _USE_OPENCL else img
+
+def _from_device(img):
+    return img.get() if isinstance(img, cv.UMat) else img
+
+def _to_gray(bgr):
     return cv.cvtColor(bgr, cv.COLOR_BGR2GRAY)
 
-def _detect_orb(gray: np.ndarray, nfeatures :int):
+# ORB cost grows with pixel count; detect on images no larger than this per side
+_DETECT_MAX_SIDE = 2000
+
+def _detection_scale(shape: Tuple[int, ...]) -> float:
+    """
+    Factor that brings the longest side of `shape` down to at most _DETECT_MAX_SIDE.
+    Detection coords = full-res coords * scale.
+    """
+    return min(1.0, _DETECT_MAX_SIDE / max(shape[:2]))
+
+def _downscale_for_detection(gray, scale: float):
+    if scale < 1.0:
+        gray = cv.resize(gray, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+    return gray
+
+def _detect_orb(gray, nfeatures :int):
     orb = cv.ORB_create(nfeatures=nfeatures)
     kps, desc = orb.detectAndCompute(gray, None)
-    return kps, desc
-
-def _match_orb(d1: np.ndarray, d2: np.ndarray, ratio: float = 0.75) -> List[cv.DMatch]:
-    # Hamming distance for ORB; KNN + Lowe's ratio test
-    bf = cv.BFMatcher(cv.NORM_HAMMING, crossCheck=False)
-    knn = bf.knnMatch(d1, d2, k=2)
-    good = []
-    for m, n in knn:
-        if m.distance < ratio * n.distance:
-            good.append(m)
-    return good
-
-def _estimate_similarity(img_pts: np.ndarray, ref_pts: np.ndarray):
+    return kps, _from_device(desc)
+
+# FLANN LSH index for binary descriptors; brute force is O(N*M) Hamming compares
+_FLANN_INDEX_LSH = 6
+_LSH_INDEX_PARAMS = dict(algorithm=_FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1)
+_LSH_SEARCH_PARAMS = dict(checks=50)
+_LSH_MIN_FEATURES = 1000  # below this brute force is cheaper than building the index
+
+def _make_matcher(train_desc: np.ndarray):
+    """
+    Build a Hamming matcher with `train_desc` indexed once, to be queried many times.
+    Searching a trained matcher is read-only, so it can be shared across threads.
+    """
+    if len(train_desc) >= _LSH_MIN_FEATURES:
+        matcher = cv.FlannBasedMatcher(_LSH_INDEX_PARAMS, _LSH_SEARCH_PARAMS)
+    else:
+        matcher = cv.BFMatcher(cv.NORM_HAMMING, crossCheck=False)
+    matcher.add([train_desc])
+    matcher.train()
+    return matcher
+
+def _match_orb(matcher, desc: np.ndarray, ratio: float = 0.75) -> Tuple[np.ndarray, np.ndarray]:
+    # Hamming distance for ORB; KNN + Lowe's ratio test of image descriptors `desc` against
+    # the matcher trained on the reference. Returns int32 (img_idx, ref_idx) arrays.
+    desc = np.ascontiguousarray(desc, dtype=np.uint8)
+    # LSH may return fewer than two neighbours for some queries
+    knn = [p for p in matcher.knnMatch(desc, k=2) if len(p) == 2]
+    n = len(knn)
+    d_best = np.fromiter((p[0].distance for p in knn), dtype=np.float32, count=n)
+    d_second = np.fromiter((p[1].distance for p in knn), dtype=np.float32, count=n)
+    keep = np.flatnonzero(d_best < ratio * d_second)
+    # the image is the query side, the reference the train side
+    img_idx = np.fromiter((knn[i][0].queryIdx for i in keep), dtype=np.int32, count=len(keep))
+    ref_idx = np.fromiter((knn[i][0].trainIdx for i in keep), dtype=np.int32, count=len(keep))
+    return img_idx, ref_idx
+
+def _match_points(kps, idx: np.ndarray) -> np.ndarray:
+    """
+    Gather keypoint coordinates for the given indices as an (N, 1, 2) float32 array.
+    """
+    # KeyPoint_convert treats an empty index list as "all keypoints"
+    if idx.size == 0:
+        return np.empty((0, 1, 2), np.float32)
+    return cv.KeyPoint_convert(kps, idx).reshape(-1, 1, 2)
+
+def _estimate_similarity(img_pts: np.ndarray, ref_pts: np.ndarray, reproj_thresh: float = 3.0):
     """
     Estimate a similarity transform (2x3) mapping img_pts -> ref_pts using RANSAC.
+    `reproj_thresh` is in the units of the points.
     Returns (M2x3, H3x3, ninliers).
     """
+    # OpenCV asserts (cv2.error) below the 2-point minimal sample; report it like any failed fit
+    if len(img_pts) < 2:
+        raise RuntimeError(f"Not enough matches to estimate similarity ({len(img_pts)}).")
     M, inliers = cv.estimateAffinePartial2D(
         img_pts, ref_pts,
+        # USAC_* methods are not accepted for the 4-DOF model, so stay on RANSAC; with a
+        # 2-point sample, 500 iterations still reach 0.995 confidence down to ~10% inliers
         method=cv.RANSAC,
-        ransacReprojThreshold=3.0,
-        maxIters=2000,
+        ransacReprojThreshold=reproj_thresh,
+        maxIters=500,
         confidence=0.995,
     )
     if M is None:
@@ -69,9 +137,10 @@ def _common_overlap_rect(masks: list[np.ndarray], erode: int = 4) -> tuple[int,
     if not masks:
         raise ValueError("No masks provided.")
 
+    # masks are 0/255, so a running min is the AND; reduce in place into one buffer
     common = masks[0].copy()
     for m in masks[1:]:
-        common = cv.bitwise_and(common, m)
+        cv.min(common, m, dst=common)
 
     # optional: make the overlap conservative
     if erode > 0:
@@ -79,27 +148,194 @@ def _common_overlap_rect(masks: list[np.ndarray], erode: int = 4) -> tuple[int,
         common = cv.erode(common, k, iterations=1)
 
     # find largest connected component to ignore tiny specks
-    num, labels = cv.connectedComponents((common > 0).astype(np.uint8))
+    num, _, stats, _ = cv.connectedComponentsWithStats(common, connectivity=8, ltype=cv.CV_32S)
     if num <= 1:  # no foreground
         raise RuntimeError("No common overlap found across images.")
     # skip label 0 (background)
-    best_label, best_count = 1, 0
-    for lbl in range(1, num):
-        cnt = int((labels == lbl).sum())
-        if cnt > best_count:
-            best_label, best_count = lbl, cnt
-    mask_largest = (labels == best_label).astype(np.uint8) * 255
-
-    # bounding rectangle of that component
-    ys, xs = np.where(mask_largest > 0)
-    if xs.size == 0:
-        raise RuntimeError("Common overlap empty after processing.")
-    x0, x1 = int(xs.min()), int(xs.max()) + 1
-    y0, y1 = int(ys.min()), int(ys.max()) + 1
-    w, h = x1 - x0, y1 - y0
+    best = 1 + int(np.argmax(stats[1:, cv.CC_STAT_AREA]))
+
+    # bounding rectangle of that component, straight from the stats table
+    x0 = int(stats[best, cv.CC_STAT_LEFT])
+    y0 = int(stats[best, cv.CC_STAT_TOP])
+    w = int(stats[best, cv.CC_STAT_WIDTH])
+    h = int(stats[best, cv.CC_STAT_HEIGHT])
     return x0, y0, w, h
 
 
+_scratch = threading.local()
+
+def _scratch_buffer(name: str, shape: Tuple[int, ...]) -> np.ndarray:
+    """
+    Per-thread uint8 work buffer, reallocated only when `shape` changes.
+    """
+    buf = getattr(_scratch, name, None)
+    if buf is None or buf.shape != shape:
+        buf = np.empty(shape, np.uint8)
+        setattr(_scratch, name, buf)
+    return buf
+
+
+def _overlap_hint_rect(
+    M_sim: np.ndarray,
+    img_shape: Tuple[int, ...],
+    ref_shape: Tuple[int, ...],
+    margin: float = 0.1,
+) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Returns (x, y, w, h), in image coords, bounding the reference frame mapped back
+    through `M_sim`, grown by `margin` of the image size and clipped to the image.
+    Other shots of the same scene keep their shared field of view about there.
+    """
+    h_ref, w_ref = ref_shape[:2]
+    h, w = img_shape[:2]
+    corners = np.float32([[0, 0], [w_ref, 0], [w_ref, h_ref], [0, h_ref]]).reshape(-1, 1, 2)
+    pts = cv.transform(corners, cv.invertAffineTransform(M_sim)).reshape(-1, 2)
+    mx, my = margin * w, margin * h
+    x0 = max(0, int(pts[:, 0].min() - mx))
+    y0 = max(0, int(pts[:, 1].min() - my))
+    x1 = min(w, int(np.ceil(pts[:, 0].max() + mx)))
+    y1 = min(h, int(np.ceil(pts[:, 1].max() + my)))
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+
+# An estimate is trusted when RANSAC agrees with enough of the matches; used to decide
+# whether an ROI-restricted detection worked or needs a full-frame retry.
+_MIN_INLIERS = 20
+_MIN_INLIER_RATIO = 0.5
+
+def _is_confident(ninl: int, n_good: int) -> bool:
+    return ninl >= _MIN_INLIERS and ninl >= _MIN_INLIER_RATIO * n_good
+
+
+def _estimate_to_ref(
+    ref_path: Path,
+    img_path: Path,
+    bgr: np.ndarray,
+    ref_kp,
+    matcher,
+    ref_scale: float,
+    nfeatures: int,
+    roi: Optional[Tuple[int, int, int, int]] = None,
+):
+    """
+    Detect ORB on `bgr` (only inside `roi` (x, y, w, h) if given), match it against the
+    reference and estimate the full-res similarity img -> ref.
+    Returns (PairMatches, M2x3, ninliers).
+    Raises ValueError if the image has too few features, RuntimeError if estimation fails.
+    """
+    x0, y0 = 0, 0
+    det_bgr = bgr
+    if roi is not None:
+        x0, y0, w, h = roi
+        det_bgr = bgr[y0:y0 + h, x0:x0 + w]
+    # the scale follows the full frame, so an roi crop is detected at the same resolution
+    # (and on fewer pixels) as the full-frame attempt
+    scale = _detection_scale(bgr.shape)
+    gray = _downscale_for_detection(_to_gray(_to_device(det_bgr)), scale)
+    kp, desc = _detect_orb(gray, nfeatures)
+
+    if desc is None or len(kp) < 8:
+        raise ValueError(f"not enough features (kp={len(kp) if kp else 0}).")
+
+    # Gather matched point coordinates (ref -> img).
+    # Keypoints live in detection coords (downscaled, and shifted by the roi origin);
+    # map them back to full-res image coords so the transform comes out full-res.
+    img_idx, ref_idx = _match_orb(matcher, desc, ratio=0.75)
+    ref_pts = _match_points(ref_kp, ref_idx) / ref_scale
+    img_pts = _match_points(kp, img_idx) / scale + np.float32([x0, y0])
+
+    # --- ADD: estimate similarity transform (img -> ref) ---
+    # TODO other algorithms
+    # keep the 3 px tolerance relative to the detection grid: it grows with the downscale
+    M_sim, H_sim, ninl = _estimate_similarity(img_pts, ref_pts, reproj_thresh=3.0 / min(ref_scale, scale))
+    # You can keep H_sim around for a later uniform pipeline (e.g., warpPerspective)
+
+    pair = PairMatches(
+        ref_path=ref_path,
+        img_path=img_path,
+        n_ref_kp=len(ref_kp),
+        n_img_kp=len(kp),
+        n_good=len(ref_idx),
+        ref_idx=ref_idx,
+        img_idx=img_idx,
+        ref_pts=ref_pts,
+        img_pts=img_pts
+    )
+    return pair, M_sim, ninl
+
+
+def _align_to_ref(
+    ref_path: Path,
+    img_path: Path,
+    bgr: np.ndarray,
+    ref_kp,
+    matcher,
+    ref_scale: float,
+    out: np.ndarray,
+    mask_out: np.ndarray,
+    nfeatures: int,
+    roi: Optional[Tuple[int, int, int, int]] = None,
+):
+    """
+    Detect + match one image against the reference and warp it into the reference frame.
+    The warped image is written into `out` (H_ref, W_ref, 3) and the validity mask into
+    `mask_out` (H_ref, W_ref); both are slots of preallocated stacks.
+    `roi` (x, y, w, h) is only a hint: if detecting inside it does not give a confident
+    estimate, the whole frame is searched again.
+    Safe to run on worker threads. Returns (PairMatches, M2x3, ninliers, aligned, mask).
+    Raises ValueError if the image has too few features, RuntimeError if estimation fails.
+    """
+    args = (ref_path, img_path, bgr, ref_kp, matcher, ref_scale, nfeatures)
+    est = None
+    if roi is not None:
+        try:
+            est = _estimate_to_ref(*args, roi)
+        except (ValueError, RuntimeError):
+            pass
+        if est is not None and not _is_confident(est[2], est[0].n_good):
+            est = None
+    if est is None:
+        est = _estimate_to_ref(*args)
+    pair, M_sim, ninl = est
+
+    h_ref, w_ref = out.shape[:2]
+
+    # --- ADD: warp this image into the reference frame ---
+    # Warp BGRA in a single pass: the opaque alpha channel doubles as the validity mask
+    # (which pixels came from real data vs borders), so no second warp is needed.
+    # The warp stays on the host: its destination is host memory either way, and the
+    # BGRA intermediates live in per-thread scratch buffers reused across images.
+    bgra = cv.cvtColor(bgr, cv.COLOR_BGR2BGRA, dst=_scratch_buffer("bgra", bgr.shape[:2] + (4,)))
+    warped = cv.warpAffine(
+        bgra, M_sim, (w_ref, h_ref),
+        dst=_scratch_buffer("warped", (h_ref, w_ref, 4)),
+        flags=cv.INTER_LINEAR,
+        borderMode=cv.BORDER_CONSTANT,
+        borderValue=(0, 0, 0, 0),
+    )
+    aligned = cv.cvtColor(warped, cv.COLOR_BGRA2BGR, dst=out)
+    # edge pixels blended with the border have partial alpha; only keep fully valid ones
+    warped_mask = cv.compare(warped[:, :, 3], 255, cv.CMP_EQ, dst=mask_out)
+
+    return pair, M_sim, ninl, aligned, warped_mask
+
+
+def _write_images(jobs: List[Tuple[Path, np.ndarray]], params: Sequence[int] = ()) -> None:
+    """
+    Encode and write (path, image) pairs on a thread pool, reporting each in order.
+    cv.imwrite releases the GIL, so the encoders run in parallel.
+    """
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+        oks = list(ex.map(lambda job: cv.imwrite(str(job[0]), job[1], params), jobs))
+    for (out_path, _), ok in zip(jobs, oks):
+        if ok:
+            rprint(f"[green]Saved[/] {out_path}")
+        else:
+            rprint(f"[red]Failed to save {out_path}")
+
+
 def align(files: List[Path], nfeatures: int = 4000, erode: int = 4):
     """
     Load images, detect ORB features, and report good matches to the reference image.
@@ -119,158 +355,151 @@ def align(files: List[Path], nfeatures: int = 4000, erode: int = 4):
         raise typer.Exit(code=1)
 
     # ---- 2) Load images
-    imgs = []
-    for p in paths:
-        img = _read_bgr(p)
-        if img is None:
-            rprint(f"[bold red]ERROR:[/] Could not read image: {p}")
+    # Decode on a small pool so the remaining reads overlap ORB on the reference.
+    with ThreadPoolExecutor(max_workers=4) as loader:
+        reads = [loader.submit(_read_bgr, p) for p in paths]
+
+        ref_bgr = reads[0].result()
+        if ref_bgr is None:
+            rprint(f"[bold red]ERROR:[/] Could not read image: {paths[0]}")
             raise typer.Exit(code=1)
-        imgs.append(img)
-
-    # ---- 3) Detect ORB on reference
-    ref_bgr = imgs[0]
-    ref_gray = _to_gray(ref_bgr)
-    ref_kp, ref_desc = _detect_orb(ref_gray, nfeatures)
-    if ref_desc is None or len(ref_kp) < 8:
-        rprint("[bold red]ERROR:[/] Not enough features in reference image.")
-        raise typer.Exit(code=1)
+
+        # ---- 3) Detect ORB on reference
+        ref_scale = _detection_scale(ref_bgr.shape)
+        ref_gray = _downscale_for_detection(_to_gray(_to_device(ref_bgr)), ref_scale)
+        ref_kp, ref_desc = _detect_orb(ref_gray, nfeatures)
+        if ref_desc is None or len(ref_kp) < 8:
+            rprint("[bold red]ERROR:[/] Not enough features in reference image.")
+            raise typer.Exit(code=1)
+        # index the reference descriptors once; every image is matched against it
+        ref_desc = np.ascontiguousarray(ref_desc, dtype=np.uint8)
+        matcher = _make_matcher(ref_desc)
+
+        imgs = [ref_bgr]
+        for p, fut in zip(paths[1:], reads[1:]):
+            img = fut.result()
+            if img is None:
+                rprint(f"[bold red]ERROR:[/] Could not read image: {p}")
+                raise typer.Exit(code=1)
+            imgs.append(img)
 
     rprint(f"[bold]Reference:[/] {paths[0]}")
     rprint(f"  keypoints: {len(ref_kp)}")
 
     # --- ADD: containers for transforms, aligned images, and masks ---
     sim_transforms_2x3: list[np.ndarray] = [np.float32([[1,0,0],[0,1,0]])]  # identity for ref
-    aligned_bgr: list[np.ndarray] = [ref_bgr.copy()]
-    aligned_masks: list[np.ndarray] = []
-
-    # build a validity mask for the reference (all ones)
+    # One preallocated slot per input: warps are written in place and the lists below
+    # hold (contiguous) views into these stacks, so there is no per-image allocation.
     h_ref, w_ref = ref_bgr.shape[:2]
-    ref_mask = np.full((h_ref, w_ref), 255, np.uint8)
-    aligned_masks.append(ref_mask)
-
-
-    # ---- 4) For each other image: detect + match to reference
-    results: List[PairMatches] = []
-    for idx in range(1, len(imgs)):
-        bgr = imgs[idx]
-        gray = _to_gray(bgr)
-        kp, desc = _detect_orb(gray, nfeatures)
+    aligned_stack = np.empty((len(imgs), h_ref, w_ref, 3), np.uint8)
+    masks_stack = np.empty((len(imgs), h_ref, w_ref), np.uint8)
 
-        if desc is None or len(kp) < 8:
-            rprint(f"[red]Skipping[/] {paths[idx]}: not enough features (kp={len(kp) if kp else 0}).")
-            continue
+    # the reference is its own aligned image, valid everywhere
+    aligned_stack[0] = ref_bgr
+    masks_stack[0] = 255
+    aligned_bgr: list[np.ndarray] = [aligned_stack[0]]
+    aligned_masks: list[np.ndarray] = [masks_stack[0]]
 
-        good = _match_orb(ref_desc, desc, ratio=0.75)
 
-        # Gather matched point coordinates (ref -> img)
-        ref_pts = np.float32([ref_kp[m.queryIdx].pt for m in good]).reshape(-1, 1, 2)
-        img_pts = np.float32([kp[m.trainIdx].pt for m in good]).reshape(-1, 1, 2)
+    # ---- 4) For each other image: detect + match to reference
+    # Images are independent given the reference descriptors, and OpenCV releases
+    # the GIL, so run them on a thread pool; results are consumed in input order.
+    def submit(ex, idx, roi=None):
+        return ex.submit(_align_to_ref, paths[0], paths[idx], imgs[idx], ref_kp, matcher, ref_scale,
+                         aligned_stack[idx], masks_stack[idx], nfeatures, roi)
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+        # Align the first image on its own: a confident transform tells where the shared
+        # field of view sits, and later shots of the same size first try ORB inside that
+        # area (falling back to the full frame when that does not hold up).
+        first = submit(ex, 1)
+        roi = None
+        try:
+            pair_first, M_first, ninl_first, *_ = first.result()
+            if _is_confident(ninl_first, pair_first.n_good):
+                roi = _overlap_hint_rect(M_first, imgs[1].shape, ref_bgr.shape)
+        except (ValueError, RuntimeError):
+            pass
+        futures = [first] + [
+            submit(ex, idx, roi if imgs[idx].shape == imgs[1].shape else None)
+            for idx in range(2, len(imgs))
+        ]
 
-        # --- ADD: estimate similarity transform (img -> ref) ---
+    results: List[PairMatches] = []
+    for idx, fut in enumerate(futures, start=1):
         try:
-            # TODO other algorithms
-            M_sim, H_sim, ninl = _estimate_similarity(img_pts, ref_pts)
+            pair, M_sim, ninl, aligned, warped_mask = fut.result()
+        except ValueError as e:
+            rprint(f"[red]Skipping[/] {paths[idx]}: {e}")
+            continue
         except RuntimeError as e:
             rprint(f"  [red]Similarity estimation failed:[/] {e}")
             continue
 
-        rprint(f"  similarity inliers: {ninl}/{len(good)}")
-
-        # (Optional) preview-warp this image into the reference frame
-        h_ref, w_ref = ref_bgr.shape[:2]
-        aligned_preview = cv.warpAffine(bgr, M_sim, (w_ref, h_ref), flags=cv.INTER_LINEAR)
-        # You can keep H_sim around for a later uniform pipeline (e.g., warpPerspective)
-
-        # --- ADD: warp this image into the reference frame ---
-        aligned = cv.warpAffine(
-            bgr, M_sim, (w_ref, h_ref),
-            flags=cv.INTER_LINEAR,
-            borderMode=cv.BORDER_CONSTANT,
-            borderValue=(0, 0, 0),
-        )
-
-        # validity mask (which pixels came from real data vs borders)
-        src_mask = np.full((bgr.shape[0], bgr.shape[1]), 255, np.uint8)
-        warped_mask = cv.warpAffine(
-            src_mask, M_sim, (w_ref, h_ref),
-            flags=cv.INTER_NEAREST,
-            borderMode=cv.BORDER_CONSTANT,
-            borderValue=0,
-        )
+        rprint(f"  similarity inliers: {ninl}/{pair.n_good}")
+        rprint(f"[green]OK[/] {paths[idx]}")
+        rprint(f"  keypoints: {pair.n_img_kp}")
+        rprint(f"  good matches to reference (ratio=0.75): {pair.n_good}")
 
         aligned_bgr.append(aligned)
         aligned_masks.append(warped_mask)
         sim_transforms_2x3.append(M_sim)
 
-
-        results.append(PairMatches(
-            ref_path=paths[0],
-            img_path=paths[idx],
-            n_ref_kp=len(ref_kp),
-            n_img_kp=len(kp),
-            n_good=len(good),
-            good_matches=good,
-            ref_pts=ref_pts,
-            img_pts=img_pts
-        ))
-
-        all_ref_indices = set()
-        for res in results:
-            for m in res.good_matches:
-                all_ref_indices.add(m.queryIdx)
-
-    if all_ref_indices:
-        ref_vis_all = ref_bgr.copy()
-        ref_kps_all = [ref_kp[i] for i in sorted(all_ref_indices)]
-        cv.drawKeypoints(
-            ref_vis_all,
-            ref_kps_all,
-            ref_vis_all,
-            color=(255, 0, 0),  # red for "all"
-            flags=cv.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS,
-        )
-
-        out_dir = Path.cwd() / "out"
-        out_dir.mkdir(exist_ok=True)
-        out_all = out_dir / "ref_matches_all.png"
-        if cv.imwrite(str(out_all), ref_vis_all):
-            rprint(f"[green]Saved[/] cumulative matched ref keypoints → {out_all}")
-        else:
-            rprint("[red]Failed to save cumulative matched image")
-
-        rprint(f"[green]OK[/] {paths[idx]}")
-        rprint(f"  keypoints: {len(kp)}")
-        rprint(f"  good matches to reference (ratio=0.75): {len(good)}")
-
-        # --- ADD: save aligned outputs for a quick check ---
-        for i, img in enumerate(aligned_bgr):
-            out_path = out_dir / f"aligned_{i:03d}.png"
-            if cv.imwrite(str(out_path), img):
-                rprint(f"[green]Saved[/] {out_path}")
-            else:
-                rprint(f"[red]Failed to save {out_path}")
-        
-        # --- ADD: compute automatic common-overlap rect and crop all aligned images ---
-        try:
-            x, y, w, h = _common_overlap_rect(aligned_masks, erode=erode)  # tweak erode as needed
-            rprint(f"[cyan]Common overlap:[/] x={x}, y={y}, w={w}, h={h}")
-        except Exception as e:
-            rprint(f"[bold red]ERROR computing overlap:[/] {e}")
-            raise typer.Exit(code=3)
-
-        cropped = [img[y:y+h, x:x+w].copy() for img in aligned_bgr]
-
-        for i, img in enumerate(cropped):
-            out_path = out_dir / f"aligned_cropped_{i:03d}.jpg"
-            if cv.imwrite(str(out_path), img, [cv.IMWRITE_JPEG_QUALITY, 100]):
-                rprint(f"[green]Saved[/] {out_path}")
-            else:
-                rprint(f"[red]Failed to save {out_path}")
-
+        results.append(pair)
 
     if not results:
         rprint("[bold red]ERROR:[/] No valid matches found against the reference.")
         raise typer.Exit(code=2)
 
+    # ---- 5) Save outputs, once, after all images are aligned
+    out_dir = Path.cwd() / "out"
+    out_dir.mkdir(exist_ok=True)
+
+    # reference keypoints matched by at least one image (sorted, unique)
+    all_ref_indices = np.unique(np.concatenate([res.ref_idx for res in results]))
+
+    ref_vis_all = ref_bgr.copy()
+    ref_kps_all = [ref_kp[i] for i in all_ref_indices]
+    if ref_scale < 1.0:
+        # keypoints were detected on the downscaled reference
+        ref_kps_all = [
+            cv.KeyPoint(k.pt[0] / ref_scale, k.pt[1] / ref_scale, k.size / ref_scale, k.angle, k.response, k.octave)
+            for k in ref_kps_all
+        ]
+    cv.drawKeypoints(
+        ref_vis_all,
+        ref_kps_all,
+        ref_vis_all,
+        color=(255, 0, 0),  # red for "all"
+        flags=cv.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS,
+    )
+
+    out_all = out_dir / "ref_matches_all.png"
+    if cv.imwrite(str(out_all), ref_vis_all):
+        rprint(f"[green]Saved[/] cumulative matched ref keypoints → {out_all}")
+    else:
+        rprint("[red]Failed to save cumulative matched image")
+
+    # --- ADD: save aligned outputs for a quick check ---
+    # OpenCV's PNG defaults (level 1 + Z_RLE) are already its fastest setting
+    _write_images([(out_dir / f"aligned_{i:03d}.png", img) for i, img in enumerate(aligned_bgr)])
+
+    # --- ADD: compute automatic common-overlap rect and crop all aligned images ---
+    try:
+        x, y, w, h = _common_overlap_rect(aligned_masks, erode=erode)  # tweak erode as needed
+        rprint(f"[cyan]Common overlap:[/] x={x}, y={y}, w={w}, h={h}")
+    except Exception as e:
+        rprint(f"[bold red]ERROR computing overlap:[/] {e}")
+        raise typer.Exit(code=3)
+
+    # row-strided views into the contiguous 3-channel stack; the cv2 binding wraps
+    # these as a Mat with a row step, so imwrite reads them without a copy
+    cropped = [img[y:y+h, x:x+w] for img in aligned_bgr]
+
+    _write_images(
+        [(out_dir / f"aligned_cropped_{i:03d}.jpg", img) for i, img in enumerate(cropped)],
+        [cv.IMWRITE_JPEG_QUALITY, 100],
+    )
+
     # (Optional) Return or store 'results' for the next step (transform estimation).
     # For now we just report counts; next step: estimate similarity/affine/homography with RANSAC.
@@ -0,0 +1,128 @@
+from pathlib import Path
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+from open_align import core
+from open_align.core import (
+    _align_to_ref,
+    _detect_orb,
+    _detection_scale,
+    _downscale_for_detection,
+    _estimate_similarity,
+    _make_matcher,
+    _overlap_hint_rect,
+    _to_gray,
+)
+
+W, H = 2600, 1600  # large enough that ORB runs on a downscaled copy
+
+
+@pytest.fixture(scope="module")
+def scene():
+    rng = np.random.default_rng(0)
+    img = cv.GaussianBlur((rng.random((H + 200, 6000, 3)) * 255).astype(np.uint8), (5, 5), 0)
+    for _ in range(500):
+        center = (int(rng.integers(0, 6000)), int(rng.integers(0, H + 200)))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv.circle(img, center, int(rng.integers(5, 60)), color, -1)
+    return img
+
+
+def _crop(scene, x, y=100):
+    return np.ascontiguousarray(scene[y:y + H, x:x + W])
+
+
+def _align(ref, img, roi=None):
+    ref_scale = _detection_scale(ref.shape)
+    ref_kp, ref_desc = _detect_orb(_downscale_for_detection(_to_gray(ref), ref_scale), 4000)
+    matcher = _make_matcher(np.ascontiguousarray(ref_desc))
+    out = np.empty((H, W, 3), np.uint8)
+    mask = np.empty((H, W), np.uint8)
+    return _align_to_ref(Path("ref"), Path("img"), img, ref_kp, matcher, ref_scale, out, mask, 4000, roi)
+
+
+def _assert_shift(M, dx, dy):
+    expected = np.float32([[1, 0, dx], [0, 1, dy]])
+    np.testing.assert_allclose(M[:, :2], expected[:, :2], atol=2e-3)
+    np.testing.assert_allclose(M[:, 2], expected[:, 2], atol=1.0)
+
+
+def test_overlap_hint_rect_translation():
+    # image content sits 300 px right of the reference: ref x = img x - 300
+    M = np.float32([[1, 0, -300], [0, 1, 0]])
+    assert _overlap_hint_rect(M, (1500, 2000), (1500, 2000)) == (100, 0, 1900, 1500)
+
+
+def test_overlap_hint_rect_no_overlap():
+    M = np.float32([[1, 0, 5000], [0, 1, 0]])
+    assert _overlap_hint_rect(M, (1500, 2000), (1500, 2000)) is None
+
+
+def test_align_recovers_shift_full_frame(scene):
+    ref, img = _crop(scene, 1700), _crop(scene, 2300, y=130)
+    pair, M, ninl, aligned, mask = _align(ref, img)
+    _assert_shift(M, 600, 30)
+    # matched points are stored in full-res coords, consistent with M
+    err = np.linalg.norm(cv.transform(pair.img_pts, M) - pair.ref_pts, axis=2)
+    assert np.median(err) < 1.0
+    # img content lands at ref x >= 600, y >= 30
+    assert mask[35:, 605:].all() and not mask[:, :595].any() and not mask[:25].any()
+
+
+def test_align_recovers_shift_inside_roi(scene):
+    ref, img = _crop(scene, 1700), _crop(scene, 2300, y=130)
+    roi = _overlap_hint_rect(np.float32([[1, 0, 600], [0, 1, 30]]), img.shape, ref.shape)
+    assert roi[0] == 0 and roi[2] < W  # the roi really restricts detection
+    _, M, _, _, _ = _align(ref, img, roi)
+    _assert_shift(M, 600, 30)
+
+
+def test_align_falls_back_when_roi_points_the_wrong_way(scene):
+    # the roi is hinted by a shot shifted right; this one is shifted left and its
+    # real overlap with the reference lies entirely outside that roi
+    ref, img = _crop(scene, 3000), _crop(scene, 1000)
+    roi = _overlap_hint_rect(np.float32([[1, 0, 2000], [0, 1, 0]]), img.shape, ref.shape)
+    assert roi == (0, 0, 860, H)  # true overlap is at img x >= 2000
+    _, M, _, _, _ = _align(ref, img, roi)
+    _assert_shift(M, -2000, 0)
+
+
+def test_estimate_similarity_needs_two_points():
+    pts = np.float32([[[10, 20]]])
+    with pytest.raises(RuntimeError):
+        _estimate_similarity(pts, pts)
+
+
+def test_align_falls_back_when_roi_yields_no_matches(scene):
+    # the roi holds only a small patch of unrelated noise: ORB finds keypoints there
+    # but fewer than two survive the ratio test, so no fit is possible inside it
+    ref, img = _crop(scene, 1700), _crop(scene, 2300, y=130)
+    img[:, :800] = 128
+    img[400:440, 300:340] = (np.random.default_rng(1).random((40, 40, 1)) > 0.5) * 255
+    _, M, _, _, _ = _align(ref, img, (0, 0, 800, H))
+    _assert_shift(M, 600, 30)
+
+
+def test_roi_detects_at_full_frame_scale_on_fewer_pixels(scene, monkeypatch):
+    ref, img = _crop(scene, 1700), _crop(scene, 2300, y=130)
+    roi = _overlap_hint_rect(np.float32([[1, 0, 600], [0, 1, 30]]), img.shape, ref.shape)
+    shapes = []
+    detect = core._detect_orb
+
+    def spy(gray, nfeatures):
+        shapes.append(gray.shape)
+        return detect(gray, nfeatures)
+
+    ref_scale = _detection_scale(ref.shape)
+    ref_kp, ref_desc = _detect_orb(_downscale_for_detection(_to_gray(ref), ref_scale), 4000)
+    matcher = _make_matcher(np.ascontiguousarray(ref_desc))
+    monkeypatch.setattr(core, "_detect_orb", spy)
+    core._estimate_to_ref(Path("ref"), Path("img"), img, ref_kp, matcher, ref_scale, 4000)
+    core._estimate_to_ref(Path("ref"), Path("img"), img, ref_kp, matcher, ref_scale, 4000, roi)
+    (full_h, full_w), (roi_h, roi_w) = shapes
+    scale = _detection_scale(img.shape)
+    assert scale < 1.0
+    assert abs(roi_w - roi[2] * scale) <= 1 and abs(roi_h - roi[3] * scale) <= 1
+    assert roi_h * roi_w < full_h * full_w